@@ -7,73 +7,25 @@ Trailing 4 months of rented listings + active listings (if available).
 import json
 import math
 import os
-from collections import defaultdict, Counter
-from statistics import median
 from datetime import datetime, timedelta
 
-# ─── Load data (active + trailing 4 months rented) ──────────────────────
-cutoff_date = (datetime.now() - timedelta(days=4 * 30)).date()
-CUTOFF_DATE = cutoff_date.strftime("%Y-%m-%d")
-
-with open("/Users/SamuelEshaghoff1/Downloads/nyc-rent-scraper/rented_raw_v2.json") as f:
-    rented_v2 = json.load(f)
-
-rented_recent = [r for r in rented_v2 if r.get("rented_date", "") >= CUTOFF_DATE]
-
-# Load active listings if available
-listings_path = "/Users/SamuelEshaghoff1/Downloads/nyc-rent-scraper/listings_raw.json"
-listings = []
-if os.path.exists(listings_path):
-    with open(listings_path) as f:
-        listings = json.load(f)
+import numpy as np
 
-all_raw = listings + rented_recent
-
-if listings:
-    print(f"Raw listings loaded: {len(listings)} active + {len(rented_recent)} rented (4mo) = {len(all_raw)} total")
-else:
-    print(f"Raw listings loaded: {len(rented_recent)} rented (4mo, no active listings available)")
-print(f"Date range for subtitle: {datetime.now().strftime('%b %Y')}")
-
-# ─── Step 1: Filter to 1BR only ─────────────────────────────────────────
-one_br = [l for l in all_raw if l.get("beds") == 1]
-print(f"1BR listings: {len(one_br)}")
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
-# ─── Step 2: Remove bad data ────────────────────────────────────────────
-BAD_TYPES = {"THREEFAMILY", "TWOFAMILY", "MIXED_USE", "TOWNHOUSE", "LAND",
-             "FOURFAMILY", "MULTIFAMILY", "COMMERCIAL"}
-
-removed_high_rent = 0
-removed_bad_type = 0
-removed_no_coords = 0
-cleaned = []
-
-for l in one_br:
-    rent = l.get("rent", 0)
-    ptype = (l.get("type") or "").upper()
-    lat = l.get("lat")
-    lng = l.get("lng")
-
-    if not lat or not lng:
-        removed_no_coords += 1
-        continue
-    if rent > 25000:
-        removed_high_rent += 1
-        continue
-    if ptype in BAD_TYPES:
-        removed_bad_type += 1
-        continue
-    if rent < 500:
-        continue
-    cleaned.append(l)
+try:
+    from numba import njit, prange
+except ImportError:
+    # No numba: the kernels below run as plain Python (same results, slower)
+    prange = range
 
-print(f"\nRemoved for bad data:")
-print(f"  Rent > $25,000: {removed_high_rent}")
-print(f"  Bad property type: {removed_bad_type}")
-print(f"  No coordinates: {removed_no_coords}")
-print(f"  Remaining after cleaning: {len(cleaned)}")
+    def njit(*args, **kwargs):
+        return lambda f: f
 
-# ─── Step 3: Region assignment (9 custom regions) ────────────────────────
+# ─── Region map (9 custom regions) ───────────────────────────────────────
 REGION_MAP = {
     # South Bronx (below 149th St)
     "Mott Haven": "South Bronx", "Melrose": "South Bronx", "Hunts Point": "South Bronx",
@@ -200,216 +152,427 @@ REGION_MAP = {
     "The Rockaways": "Queens", "Whitestone": "Queens", "Woodhaven": "Queens",
 }
 
-def get_region(listing):
-    n = listing.get("neighborhood", "")
-    if n in REGION_MAP:
-        return REGION_MAP[n]
-    lat = listing["lat"]
-    lng = listing["lng"]
+# Regions are carried as int8 codes; alphabetical order so that code order
+# matches the sorted region listing printed in Step 5.
+REGIONS = sorted(set(REGION_MAP.values()))
+REGION_IDX = {r: i for i, r in enumerate(REGIONS)}
+
+# Neighborhoods are interned as int codes at load time. The vocabulary is
+# seeded with REGION_MAP's names, so a code below len(REGION_MAP) is a mapped
+# neighborhood and its region is REGION_OF_HOOD[code]; no per-listing dict
+# lookups against REGION_MAP are needed.
+REGION_OF_HOOD = np.array([REGION_IDX[r] for r in REGION_MAP.values()], dtype=np.int8)
+
+# ─── Load data (active + trailing 4 months rented) ──────────────────────
+cutoff_date = (datetime.now() - timedelta(days=4 * 30)).date()
+CUTOFF_DATE = cutoff_date.strftime("%Y-%m-%d")
+
+rented_path = "/Users/SamuelEshaghoff1/Downloads/nyc-rent-scraper/rented_raw_v2.json"
+listings_path = "/Users/SamuelEshaghoff1/Downloads/nyc-rent-scraper/listings_raw.json"
+
+def load_json(path):
+    """Parse a JSON file from raw bytes, with orjson when it is installed.
+
+    orjson rejects the NaN/Infinity tokens the json module accepts, so a
+    file orjson cannot parse is retried with json.
+    """
+    with open(path, "rb") as f:
+        raw = f.read()
+    if orjson:
+        try:
+            return orjson.loads(raw)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(raw)
+
+def load_columns(path, cutoff=None):
+    """Parse one listings file straight into NumPy columns.
+
+    With a cutoff, only listings rented on or after that date are kept.
+    Missing beds/lat/lng/rent become NaN; type and neighborhood are coded as
+    small ints against vocabularies local to this file (returned alongside,
+    in code order).
+    """
+    rows = load_json(path)
+    if cutoff is not None:
+        rows = [r for r in rows if r.get("rented_date", "") >= cutoff]
+    type_vocab = {}
+    nhood_vocab = {}
+    return {
+        "beds": np.array([l.get("beds") for l in rows], dtype=np.float64),
+        "rent": np.array([l.get("rent", 0) for l in rows], dtype=np.float64),
+        "lat": np.array([l.get("lat") for l in rows], dtype=np.float64),
+        "lng": np.array([l.get("lng") for l in rows], dtype=np.float64),
+        "type_code": np.fromiter(
+            (type_vocab.setdefault(l.get("type"), len(type_vocab)) for l in rows),
+            dtype=np.int16, count=len(rows)),
+        "nhood_code": np.fromiter(
+            (nhood_vocab.setdefault(l.get("neighborhood", ""), len(nhood_vocab)) for l in rows),
+            dtype=np.int32, count=len(rows)),
+        "type_vocab": list(type_vocab),
+        "nhood_vocab": list(nhood_vocab),
+    }
+
+# Load active listings if available
+parts = []
+if os.path.exists(listings_path):
+    parts.append(load_columns(listings_path))
+parts.append(load_columns(rented_path, CUTOFF_DATE))
+n_raw = sum(len(p["rent"]) for p in parts)
+n_rented = len(parts[-1]["rent"])
+n_listings = n_raw - n_rented
+
+if n_listings:
+    print(f"Raw listings loaded: {n_listings} active + {n_rented} rented (4mo) = {n_raw} total")
+else:
+    print(f"Raw listings loaded: {n_rented} rented (4mo, no active listings available)")
+print(f"Date range for subtitle: {datetime.now().strftime('%b %Y')}")
+
+# ─── Columnar layout ────────────────────────────────────────────────────
+# Active listings first, then rented. Every step below filters and groups
+# these arrays. File-local type/neighborhood codes are remapped onto shared
+# vocabularies.
+def recode(codes, local_vocab, vocab):
+    """Map file-local codes onto vocab, adding unseen values to it."""
+    remap = np.array([vocab.setdefault(v, len(vocab)) for v in local_vocab], dtype=codes.dtype)
+    return remap[codes]
+
+type_vocab = {}
+nhood_vocab = {n: i for i, n in enumerate(REGION_MAP)}
+type_code = np.concatenate([recode(p["type_code"], p["type_vocab"], type_vocab) for p in parts])
+nhood_code = np.concatenate([recode(p["nhood_code"], p["nhood_vocab"], nhood_vocab) for p in parts])
+nhood_names = list(nhood_vocab)
+beds, rent, lat, lng = (np.concatenate([p[c] for p in parts]) for c in ("beds", "rent", "lat", "lng"))
+
+# ─── Step 1: Filter to 1BR only ─────────────────────────────────────────
+one_br = beds == 1
+print(f"1BR listings: {np.count_nonzero(one_br)}")
+
+# ─── Step 2: Remove bad data ────────────────────────────────────────────
+BAD_TYPES = frozenset({"THREEFAMILY", "TWOFAMILY", "MIXED_USE", "TOWNHOUSE", "LAND",
+                       "FOURFAMILY", "MULTIFAMILY", "COMMERCIAL"})
+
+# Rules apply in priority order (coords, then rent cap, then property type);
+# a listing is counted under the first rule it fails.
+# Raw types are upper-cased and checked once per distinct value, then the
+# per-listing test is a lookup into that table.
+bad_type_of_code = np.array([(t or "").upper() in BAD_TYPES for t in type_vocab], dtype=bool)
+bad_type = bad_type_of_code[type_code]
+has_coords = np.isfinite(lat) & np.isfinite(lng) & (lat != 0) & (lng != 0)
+high_rent = rent > 25000
+
+removed_no_coords = np.count_nonzero(one_br & ~has_coords)
+removed_high_rent = np.count_nonzero(one_br & has_coords & high_rent)
+removed_bad_type = np.count_nonzero(one_br & has_coords & (rent <= 25000) & bad_type)
+cleaned = one_br & has_coords & (rent <= 25000) & ~bad_type & (rent >= 500)
+
+rent = rent[cleaned]
+lat = lat[cleaned]
+lng = lng[cleaned]
+nhood_code = nhood_code[cleaned]
+
+print(f"\nRemoved for bad data:")
+print(f"  Rent > $25,000: {removed_high_rent}")
+print(f"  Bad property type: {removed_bad_type}")
+print(f"  No coordinates: {removed_no_coords}")
+print(f"  Remaining after cleaning: {len(rent)}")
+
+# ─── Step 3: Region assignment ──────────────────────────────────────────
+def get_region_by_coord(lat, lng):
+    """Region code from coordinates, for listings with an unmapped neighborhood.
+
+    The rules are evaluated as boolean masks and resolved in priority order
+    by np.select; the first matching rule wins.
+    """
     # Staten Island
-    if lat < 40.65 and lng < -74.04:
-        return "Staten Island"
-    # Bronx
-    if lat > 40.85 or (lat > 40.80 and lng > -73.94):
-        if lat < 40.818:
-            return "South Bronx"
-        return "Bronx"
-    # Manhattan
-    if -74.03 < lng < -73.90 and 40.70 < lat < 40.88:
-        if lng > -73.96 or lat < 40.75:
-            # East side: 96th St boundary (~40.785)
-            # West side: 110th St boundary (~40.800)
-            if lng > -73.96 and lat >= 40.785:
-                return "Upper Manhattan"
-            if lng <= -73.96 and lat >= 40.800:
-                return "Upper Manhattan"
-            return "Lower Manhattan"
+    si = (lat < 40.65) & (lng < -74.04)
+    # Bronx (South Bronx below 149th St)
+    bronx = (lat > 40.85) | ((lat > 40.80) & (lng > -73.94))
+    south_bronx = bronx & (lat < 40.818)
+    # Manhattan. East side: 96th St boundary (~40.785),
+    # West side: 110th St boundary (~40.800)
+    manhattan = ((-74.03 < lng) & (lng < -73.90) & (40.70 < lat) & (lat < 40.88)
+                 & ((lng > -73.96) | (lat < 40.75)))
+    upper = ((lng > -73.96) & (lat >= 40.785)) | ((lng <= -73.96) & (lat >= 40.800))
     # Brooklyn
-    if lat < 40.74 and lng < -73.83:
-        if lat > 40.660:
-            return "North Brooklyn"
-        return "South Brooklyn"
+    brooklyn = (lat < 40.74) & (lng < -73.83)
     # Queens
-    if lng > -73.95 and lng < -73.90 and lat > 40.73:
-        return "W. Queens"
-    return "Queens"
-
-for l in cleaned:
-    l["borough"] = get_region(l)
-
-unknowns = [l for l in cleaned if l["borough"] == "Unknown"]
-if unknowns:
-    unknown_hoods = Counter(l.get("neighborhood", "?") for l in unknowns)
-    print(f"\nUnknown region listings: {len(unknowns)}")
-    for h, c in unknown_hoods.most_common(20):
-        sample = next(l for l in unknowns if l.get("neighborhood") == h)
-        print(f"  {h}: {c} (lat={sample['lat']}, lng={sample['lng']})")
+    w_queens = (lng > -73.95) & (lng < -73.90) & (lat > 40.73)
+
+    return np.select(
+        [si, south_bronx, bronx, manhattan & upper, manhattan,
+         brooklyn & (lat > 40.660), brooklyn, w_queens],
+        [REGION_IDX[r] for r in ("Staten Island", "South Bronx", "Bronx",
+                                 "Upper Manhattan", "Lower Manhattan",
+                                 "North Brooklyn", "South Brooklyn", "W. Queens")],
+        default=REGION_IDX["Queens"]).astype(np.int8)
+
+# Mapped neighborhoods resolve through the interned codes; the coordinate
+# rules only run on listings whose neighborhood isn't in REGION_MAP.
+mapped = nhood_code < len(REGION_MAP)
+region = np.empty(len(rent), dtype=np.int8)
+region[mapped] = REGION_OF_HOOD[nhood_code[mapped]]
+region[~mapped] = get_region_by_coord(lat[~mapped], lng[~mapped])
+
+unknown = region < 0
+if unknown.any():
+    unknown_hoods = np.bincount(nhood_code[unknown], minlength=len(nhood_names))
+    top = np.argsort(-unknown_hoods, kind="stable")[:20]
+    print(f"\nUnknown region listings: {np.count_nonzero(unknown)}")
+    for code in top[unknown_hoods[top] > 0].tolist():
+        sample = np.flatnonzero(unknown & (nhood_code == code))[0]
+        print(f"  {nhood_names[code] or '?'}: {unknown_hoods[code]} (lat={lat[sample]}, lng={lng[sample]})")
 
 # ─── Step 4: RS Filter ──────────────────────────────────────────────────
+# Grid cells are grouped by sorting integer Morton cell keys once and
+# walking the runs of equal keys; nothing is hashed. A listing's cell index
+# is round(x / grid), the cell whose center is nearest.
+CELL_INDEX_OFFSET = 1 << 20  # makes cell indices non-negative (|lng / 0.002| < 2**17)
+
+def spread_bits(v):
+    """Move the low 32 bits of each uint64 in v to the even bit positions."""
+    v = v & 0xffffffff
+    v = (v | (v << 16)) & 0x0000ffff0000ffff
+    v = (v | (v << 8)) & 0x00ff00ff00ff00ff
+    v = (v | (v << 4)) & 0x0f0f0f0f0f0f0f0f
+    v = (v | (v << 2)) & 0x3333333333333333
+    return (v | (v << 1)) & 0x5555555555555555
+
+def cell_key(ilat, ilng, tag=0):
+    """Morton (Z-order) code of integer cell coordinates, as a uint64 key.
+
+    Interleaving the lat/lng index bits keeps neighboring cells close in key
+    order. tag (0/1, scalar or per row) sets bit 62 so that cells from two
+    different grids sharing one key space never collide.
+    """
+    ilat = (ilat.astype(np.int64) + CELL_INDEX_OFFSET).astype(np.uint64)
+    ilng = (ilng.astype(np.int64) + CELL_INDEX_OFFSET).astype(np.uint64)
+    tag = np.asarray(tag).astype(np.uint64) << 62
+    return tag | (spread_bits(ilat) << 1) | spread_bits(ilng)
+
+def key_runs(sorted_key):
+    """Start offset and length of each run of equal keys in a sorted array."""
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(sorted_key)) + 1))
+    return starts, np.diff(np.append(starts, len(sorted_key)))
+
 SPATIAL_GRID = 0.01
-spatial_cells = defaultdict(list)
-for l in cleaned:
-    key = (round(l["lat"] / SPATIAL_GRID) * SPATIAL_GRID,
-           round(l["lng"] / SPATIAL_GRID) * SPATIAL_GRID)
-    spatial_cells[key].append(l["rent"])
-
-spatial_medians = {}
-for key, rents in spatial_cells.items():
-    if len(rents) >= 3:
-        spatial_medians[key] = median(rents)
-
-def get_spatial_median(lat, lng):
-    key = (round(lat / SPATIAL_GRID) * SPATIAL_GRID,
-           round(lng / SPATIAL_GRID) * SPATIAL_GRID)
-    return spatial_medians.get(key)
-
-rs_flagged = 0
-non_rs = []
-for l in cleaned:
-    rent = l["rent"]
-    lat = l["lat"]
-    lng = l["lng"]
-    is_rs = False
-
-    # Single RS rule: Below 60% of local spatial median
-    sm = get_spatial_median(lat, lng)
-    if sm and rent < sm * 0.60:
-        is_rs = True
-
-    if is_rs:
-        rs_flagged += 1
-    else:
-        non_rs.append(l)
+key = cell_key(np.round(lat / SPATIAL_GRID), np.round(lng / SPATIAL_GRID))
+
+# One lexsort orders rows by cell and by rent within each cell, so the
+# median (statistics.median semantics, mean of the middle pair for even
+# counts) is two indexed reads per run.
+order = np.lexsort((rent, key))
+sorted_rent = rent[order]
+starts, counts = key_runs(key[order])
+spatial_medians = (sorted_rent[starts + (counts - 1) // 2] + sorted_rent[starts + counts // 2]) / 2
+
+# Single RS rule: Below 60% of local spatial median (cells with <3
+# listings have no median and never flag anything)
+sm = np.empty(len(rent))
+sm[order] = np.repeat(np.where(counts >= 3, spatial_medians, 0), counts)
+is_rs = rent < sm * 0.60
+rs_flagged = np.count_nonzero(is_rs)
+
+non_rs = ~is_rs
+rent = rent[non_rs]
+lat = lat[non_rs]
+lng = lng[non_rs]
+region = region[non_rs]
 
 print(f"\nRS filter: flagged {rs_flagged} listings (below 60% of spatial median)")
-print(f"After RS filter: {len(non_rs)} listings")
+print(f"After RS filter: {len(rent)} listings")
 
 # ─── Step 5: Borough medians ────────────────────────────────────────────
-borough_listings = defaultdict(list)
-for l in non_rs:
-    borough_listings[l["borough"]].append(l)
-
 print(f"\nRegion means:")
+region_sums = np.bincount(region, weights=rent, minlength=len(REGIONS))
+region_counts = np.bincount(region, minlength=len(REGIONS))
 borough_means = {}
-for borough, lsts in sorted(borough_listings.items()):
-    rents = [l["rent"] for l in lsts]
-    avg = int(round(sum(rents) / len(rents)))
+for code in np.flatnonzero(region_counts).tolist():
+    borough = REGIONS[code]
+    avg = int(round(region_sums[code] / region_counts[code]))
     borough_means[borough] = avg
-    print(f"  {borough}: ${avg:,.0f} (n={len(rents)})")
+    print(f"  {borough}: ${avg:,.0f} (n={region_counts[code]})")
 
 # ─── Step 6: Dense adaptive grid heat points ────────────────────────────
-def get_grid_size(lat, lng):
-    if lat < 40.786 and lng > -74.02 and lng < -73.93:
-        return 0.002
-    if 40.68 < lat < 40.73 and -73.99 < lng < -73.93:
-        return 0.002
-    return 0.003
+# Grid size per row as an int code into GS_TABLE: 0 = fine 0.002 grid
+# (Manhattan below 40.786 and the Williamsburg/Greenpoint box), 1 = 0.003.
+GS_TABLE = np.array([0.002, 0.003])
+
+def get_grid_code(lat, lng):
+    fine = (((lat < 40.786) & (lng > -74.02) & (lng < -73.93))
+            | ((lat > 40.68) & (lat < 40.73) & (lng > -73.99) & (lng < -73.93)))
+    return (~fine).astype(np.int8)
 
 # FIX: Require >= 2 listings per cell to eliminate ghost points
 MIN_CELL_COUNT = 2
 
-grid_cells = defaultdict(list)
-for l in non_rs:
-    lat = l["lat"]
-    lng = l["lng"]
-    gs = get_grid_size(lat, lng)
-    cell_lat = round(lat / gs) * gs
-    cell_lng = round(lng / gs) * gs
-    key = (round(cell_lat, 6), round(cell_lng, 6), gs)
-    grid_cells[key].append(l)
-
-heat_points = []
-dropped_thin = 0
-for (clat, clng, gs), lsts in grid_cells.items():
-    if len(lsts) < MIN_CELL_COUNT:
-        dropped_thin += 1
-        continue
-    rents = [l["rent"] for l in lsts]
-    mean_rent = sum(rents) / len(rents)
-    heat_points.append({
-        "lat": round(clat, 4),
-        "lng": round(clng, 4),
-        "rent": int(round(mean_rent)),
-        "count": len(lsts),
-    })
-
-# ─── Spatial smoothing pass ─────────────────────────────────────────────
+gs_code = get_grid_code(lat, lng)
+gs = GS_TABLE[gs_code]
+ilat = np.round(lat / gs)
+ilng = np.round(lng / gs)
+key = cell_key(ilat, ilng, tag=gs_code)
+
+# A stable sort keeps each run in row order, so a run's first row is the
+# cell's first appearance; cells are ordered by first appearance.
+order = np.argsort(key, kind="stable")
+starts, counts = key_runs(key[order])
+cell_rent = np.add.reduceat(rent[order], starts) / counts
+first = order[starts]
+
+thick = counts >= MIN_CELL_COUNT
+dropped_thin = len(counts) - np.count_nonzero(thick)
+cells = np.flatnonzero(thick)
+cells = cells[np.argsort(first[cells])]
+first = first[cells]
+hp_lat = np.round(ilat[first] * gs[first], 4)
+hp_lng = np.round(ilng[first] * gs[first], 4)
+hp_rent = np.rint(cell_rent[cells])
+hp_count = counts[cells]
+
+# ─── Spatial smoothing + neighbor median clamping ──────────────────────
 SMOOTH_RADIUS = 0.008
-smoothed_points = []
-for i, hp in enumerate(heat_points):
-    total_weight = 2.0
-    weighted_rent = hp["rent"] * 2.0
-    for j, other in enumerate(heat_points):
-        if i == j:
-            continue
-        dlat = hp["lat"] - other["lat"]
-        dlng = hp["lng"] - other["lng"]
-        dist = math.sqrt(dlat**2 + dlng**2)
-        if dist < SMOOTH_RADIUS and dist > 0:
-            w = 1.0 / dist
-            total_weight += w
-            weighted_rent += other["rent"] * w
-    smoothed_rent = int(round(weighted_rent / total_weight))
-    smoothed_points.append({
-        "lat": hp["lat"],
-        "lng": hp["lng"],
-        "rent": smoothed_rent,
-        "count": hp["count"],
-    })
-heat_points = smoothed_points
-print(f"Spatial smoothing applied (radius={SMOOTH_RADIUS}deg, ~800m)")
-
-# ─── Neighbor median clamping ────────────────────────────────────────────
 # FIX: Relaxed from >= 2 neighbors to >= 1 to catch isolated outliers
 CLAMP_RADIUS = 0.015
 CLAMP_THRESHOLD = 1.50
 CLAMP_MAX_N = 10
-clamped_count = 0
-for i, hp in enumerate(heat_points):
-    if hp["count"] >= CLAMP_MAX_N:
-        continue
-    neighbors = []
-    for j, other in enumerate(heat_points):
-        if i == j:
+
+@njit(parallel=True, fastmath=True, cache=True)
+def smooth_rents(indptr, indices, lat, lng, rent, smooth_radius):
+    """Inverse-distance smoothed rent of every heat point (rows run in parallel).
+
+    indptr/indices hold each point's neighbors within the clamp radius,
+    self included (a superset of the smoothing neighbors).
+    """
+    n = len(rent)
+    smooth_r2 = smooth_radius * smooth_radius
+    smoothed = np.empty(n, np.int64)
+    for i in prange(n):
+        total_weight = 2.0
+        weighted_rent = rent[i] * 2.0
+        for k in range(indptr[i], indptr[i + 1]):
+            j = indices[k]
+            dlat = lat[i] - lat[j]
+            dlng = lng[i] - lng[j]
+            d2 = dlat * dlat + dlng * dlng
+            # Radius test on squared distance; sqrt only for pairs that pass
+            if d2 < smooth_r2 and d2 > 0:
+                w = 1.0 / math.sqrt(d2)
+                total_weight += w
+                weighted_rent += rent[j] * w
+        smoothed[i] = np.rint(weighted_rent / total_weight)
+    return smoothed
+
+@njit(cache=True)
+def clamp_to_neighbor_median(indptr, indices, rent, count, max_n, threshold):
+    """Clamp rents far above the upper median of their neighbors, in place.
+
+    Points are visited in order and each median is taken from the current
+    rents, so a point clamped earlier counts at its clamped value; the loop
+    is serial for that reason. Returns each point's pre-clamp rent, the
+    median it was clamped to (-1 for points left alone) and its neighbor
+    count.
+    """
+    n = len(rent)
+    old = np.full(n, -1, np.int64)
+    med = np.full(n, -1, np.int64)
+    n_neighbors = np.zeros(n, np.int64)
+    for i in range(n):
+        if count[i] >= max_n:
             continue
-        dlat = hp["lat"] - other["lat"]
-        dlng = hp["lng"] - other["lng"]
-        dist = math.sqrt(dlat**2 + dlng**2)
-        if dist < CLAMP_RADIUS:
-            neighbors.append(other["rent"])
-    if len(neighbors) >= 1:
-        neighbor_med = sorted(neighbors)[len(neighbors) // 2]
-        if hp["rent"] > neighbor_med * CLAMP_THRESHOLD:
-            old_rent = hp["rent"]
-            hp["rent"] = neighbor_med
-            clamped_count += 1
-            if old_rent > neighbor_med * 2:
-                print(f"  CLAMPED: ({hp['lat']},{hp['lng']}) ${old_rent:,} → ${neighbor_med:,} (n={hp['count']}, {len(neighbors)} neighbors)")
+        buf = np.empty(indptr[i + 1] - indptr[i], np.int64)
+        m = 0
+        for k in range(indptr[i], indptr[i + 1]):
+            j = indices[k]
+            if j != i:
+                buf[m] = rent[j]
+                m += 1
+        n_neighbors[i] = m
+        if m == 0:
+            continue
+        mid = np.partition(buf[:m], m // 2)[m // 2]
+        if rent[i] > mid * threshold:
+            old[i] = rent[i]
+            med[i] = mid
+            rent[i] = mid
+    return old, med, n_neighbors
+
+def radius_neighbors(lat, lng, radius):
+    """CSR neighbor lists: every point within radius of each point, self included.
+
+    Points are bucketed on a uniform grid with cell size = radius, so all
+    neighbors of a point sit in the 3x3 block of buckets around its own.
+    Buckets are found by binary search on the sorted bucket keys, and the
+    candidates are filtered on squared distance (no sqrt). Each row's
+    neighbors come back in ascending index order.
+    """
+    n = len(lat)
+    blat = np.floor(lat / radius)
+    blng = np.floor(lng / radius)
+    bkey = cell_key(blat, blng)
+    order = np.argsort(bkey, kind="stable")
+    sorted_key = bkey[order]
+
+    rows, cols = [], []
+    for dlat_b in (-1, 0, 1):
+        for dlng_b in (-1, 0, 1):
+            key = cell_key(blat + dlat_b, blng + dlng_b)
+            lo = np.searchsorted(sorted_key, key, "left")
+            cnt = np.searchsorted(sorted_key, key, "right") - lo
+            row = np.repeat(np.arange(n), cnt)
+            # lo[row] + 0..cnt-1 for every query row
+            pos = np.arange(len(row)) - np.repeat(np.cumsum(cnt) - cnt, cnt) + lo[row]
+            rows.append(row)
+            cols.append(order[pos])
+    rows = np.concatenate(rows)
+    cols = np.concatenate(cols)
+    dlat = lat[rows] - lat[cols]
+    dlng = lng[rows] - lng[cols]
+    near = dlat * dlat + dlng * dlng < radius * radius
+    rows, cols = rows[near], cols[near]
+
+    grouped = np.lexsort((cols, rows))
+    indptr = np.zeros(n + 1, np.int64)
+    indptr[1:] = np.cumsum(np.bincount(rows, minlength=n))
+    return indptr, cols[grouped].astype(np.int64)
+
+# One radius query at the clamp radius gives a CSR neighbor list that
+# serves both passes (smooth_rents applies the smoothing radius itself).
+indptr, indices = radius_neighbors(hp_lat, hp_lng, CLAMP_RADIUS)
+
+hp_rent = smooth_rents(indptr, indices, hp_lat, hp_lng, hp_rent, SMOOTH_RADIUS)
+print(f"Spatial smoothing applied (radius={SMOOTH_RADIUS}deg, ~800m)")
+
+old_rent, neighbor_med, n_neighbors = clamp_to_neighbor_median(
+    indptr, indices, hp_rent, hp_count, CLAMP_MAX_N, CLAMP_THRESHOLD)
+clamped = neighbor_med >= 0
+for i in np.flatnonzero(clamped & (old_rent > neighbor_med * 2)).tolist():
+    print(f"  CLAMPED: ({hp_lat[i]},{hp_lng[i]}) ${old_rent[i]:,} → ${neighbor_med[i]:,} (n={hp_count[i]}, {n_neighbors[i]} neighbors)")
+clamped_count = np.count_nonzero(clamped)
 print(f"Neighbor median clamping: {clamped_count} points clamped (n<{CLAMP_MAX_N}, >{CLAMP_THRESHOLD:.0%} of neighbor median)")
 
-heat_points.sort(key=lambda x: (-x["rent"], x["lat"]))
-print(f"\nHeat points generated: {len(heat_points)} (dropped {dropped_thin} thin cells with <{MIN_CELL_COUNT} listings)")
+# Highest rent first, ties by latitude (lexsort is stable, like list.sort)
+order = np.lexsort((hp_lat, -hp_rent))
+hp_lat, hp_lng, hp_rent, hp_count = hp_lat[order], hp_lng[order], hp_rent[order], hp_count[order]
+print(f"\nHeat points generated: {len(hp_rent)} (dropped {dropped_thin} thin cells with <{MIN_CELL_COUNT} listings)")
 
 # ─── Write output ────────────────────────────────────────────────────────
+rows = [f"  {{lat:{la},lng:{ln},rent:{r},n:{c}}},\n"
+        for la, ln, r, c in zip(hp_lat.tolist(), hp_lng.tolist(), hp_rent.tolist(), hp_count.tolist())]
 with open("/tmp/heat_points_baseline_v2.js", "w") as f:
-    f.write("const HEAT_POINTS = [\n")
-    for hp in heat_points:
-        f.write(f"  {{lat:{hp['lat']},lng:{hp['lng']},rent:{hp['rent']},n:{hp['count']}}},\n")
-    f.write("];\n")
+    f.write("const HEAT_POINTS = [\n" + "".join(rows) + "];\n")
 
 print(f"\nOutput: /tmp/heat_points_baseline_v2.js")
 
 # ─── Summary ─────────────────────────────────────────────────────────────
-all_rents = [l["rent"] for l in non_rs]
-nyc_mean = int(round(sum(all_rents) / len(all_rents)))
+nyc_mean = int(round(rent.sum() / len(rent)))
 print(f"\nNYC overall mean: ${nyc_mean:,}")
-print(f"Total listings used: {len(non_rs)}")
+print(f"Total listings used: {len(rent)}")
 
 # Check Mill Basin area
 print("\n--- Mill Basin check ---")
-mb = [hp for hp in heat_points if 40.59 <= hp["lat"] <= 40.62 and -73.94 <= hp["lng"] <= -73.90]
-if mb:
-    for hp in mb:
-        print(f"  ${hp['rent']:>6,}  lat={hp['lat']}, lng={hp['lng']}  n={hp['count']}")
+mb = (40.59 <= hp_lat) & (hp_lat <= 40.62) & (-73.94 <= hp_lng) & (hp_lng <= -73.90)
+if mb.any():
+    for la, ln, r, c in zip(hp_lat[mb].tolist(), hp_lng[mb].tolist(), hp_rent[mb].tolist(), hp_count[mb].tolist()):
+        print(f"  ${r:>6,}  lat={la}, lng={ln}  n={c}")
 else:
     print("  No heat points in Mill Basin ✓")
@@ -8,74 +8,174 @@ Two fixes stacked:
 This fixes both the cell-mixing problem AND the smoothing-drag problem.
 """
 
+import hashlib
 import json
 import math
 import os
-from collections import defaultdict, Counter
-from statistics import median
+from collections import Counter
 from datetime import datetime, timedelta
 
+import numpy as np
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    from numba import njit, prange
+except ImportError:
+    # No numba: the kernels below run as plain Python (same results, slower)
+    prange = range
+
+    def njit(*args, **kwargs):
+        return lambda f: f
+
 # ─── Load data (active + trailing 4 months rented) ──────────────────────
 cutoff_date = (datetime.now() - timedelta(days=4 * 30)).date()
 CUTOFF_DATE = cutoff_date.strftime("%Y-%m-%d")
 
-with open("/Users/SamuelEshaghoff1/Downloads/nyc-rent-scraper/rented_raw_v2.json") as f:
-    rented_v2 = json.load(f)
+rented_path = "/Users/SamuelEshaghoff1/Downloads/nyc-rent-scraper/rented_raw_v2.json"
+listings_path = "/Users/SamuelEshaghoff1/Downloads/nyc-rent-scraper/listings_raw.json"
 
-rented_recent = [r for r in rented_v2 if r.get("rented_date", "") >= CUTOFF_DATE]
+def load_json(path):
+    """Parse a JSON file from raw bytes, with orjson when it is installed.
+
+    orjson rejects the NaN/Infinity tokens the json module accepts, so a
+    file orjson cannot parse is retried with json.
+    """
+    with open(path, "rb") as f:
+        raw = f.read()
+    if orjson:
+        try:
+            return orjson.loads(raw)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(raw)
+
+def load_columns(path, cutoff=None):
+    """Parse one listings file straight into NumPy columns.
+
+    With a cutoff, only listings rented on or after that date are kept.
+    Missing beds/lat/lng/rent become NaN; type (upper-cased) and neighborhood
+    are coded as small ints against vocabularies local to this file,
+    returned alongside in code order. The parsed dicts are dropped on return.
+    """
+    rows = load_json(path)
+    if cutoff is not None:
+        rows = [r for r in rows if (r.get("rented_date") or "") >= cutoff]
+    type_vocab = {}
+    nhood_vocab = {}
+    return {
+        "beds": np.array([l.get("beds") for l in rows], dtype=np.float64),
+        "rent": np.array([l.get("rent", 0) for l in rows], dtype=np.float64),
+        "lat": np.array([l.get("lat") for l in rows], dtype=np.float64),
+        "lng": np.array([l.get("lng") for l in rows], dtype=np.float64),
+        "type_id": np.fromiter(
+            (type_vocab.setdefault((l.get("type") or "").upper(), len(type_vocab)) for l in rows),
+            dtype=np.int16, count=len(rows)),
+        "nhood_id": np.fromiter(
+            (nhood_vocab.setdefault(l.get("neighborhood", "Unknown"), len(nhood_vocab)) for l in rows),
+            dtype=np.int32, count=len(rows)),
+        "type_vocab": list(type_vocab),
+        "nhood_vocab": list(nhood_vocab),
+    }
+
+CACHE_DIR = "/tmp/nyc_rent_cache"
+CACHE_COLUMNS = ("beds", "rent", "lat", "lng", "type_id", "nhood_id")
+CACHE_VERSION = 1  # bump whenever load_columns changes what it returns
+
+def cached_columns(path, cutoff=None):
+    """load_columns(path, cutoff), cached as .npy files under CACHE_DIR.
+
+    Entries are keyed on (CACHE_VERSION, path, mtime, cutoff), so a parser
+    change, a rewritten source file or a new cutoff date starts a fresh
+    entry. A hit memory-maps the columns instead of parsing the JSON. Each
+    file is written under a temporary name and renamed into place, and the
+    vocab file goes last, so it marks an entry as complete.
+    """
+    key = repr((CACHE_VERSION, os.path.abspath(path), os.stat(path).st_mtime_ns, cutoff))
+    base = os.path.join(CACHE_DIR, hashlib.sha1(key.encode()).hexdigest()[:16])
+    vocab_path = base + ".vocab.json"
+    if os.path.exists(vocab_path):
+        with open(vocab_path) as f:
+            cols = json.load(f)
+        for c in CACHE_COLUMNS:
+            cols[c] = np.load(f"{base}.{c}.npy", mmap_mode="r")
+        return cols
+
+    cols = load_columns(path, cutoff)
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp = f".{os.getpid()}.tmp"
+    for c in CACHE_COLUMNS:
+        np.save(f"{base}.{c}{tmp}.npy", cols[c])
+        os.replace(f"{base}.{c}{tmp}.npy", f"{base}.{c}.npy")
+    with open(vocab_path + tmp, "w") as f:
+        json.dump({"type_vocab": cols["type_vocab"], "nhood_vocab": cols["nhood_vocab"]}, f)
+    os.replace(vocab_path + tmp, vocab_path)
+    return cols
 
 # Load active listings if available
-listings_path = "/Users/SamuelEshaghoff1/Downloads/nyc-rent-scraper/listings_raw.json"
-listings = []
+parts = []
 if os.path.exists(listings_path):
-    with open(listings_path) as f:
-        listings = json.load(f)
-
-all_raw = listings + rented_recent
-
-if listings:
-    print(f"Raw listings loaded: {len(listings)} active + {len(rented_recent)} rented (4mo) = {len(all_raw)} total")
+    parts.append(cached_columns(listings_path))
+parts.append(cached_columns(rented_path, CUTOFF_DATE))
+n_raw = sum(len(p["rent"]) for p in parts)
+n_rented = len(parts[-1]["rent"])
+n_listings = n_raw - n_rented
+
+if n_listings:
+    print(f"Raw listings loaded: {n_listings} active + {n_rented} rented (4mo) = {n_raw} total")
 else:
-    print(f"Raw listings loaded: {len(rented_recent)} rented (4mo, no active listings available)")
+    print(f"Raw listings loaded: {n_rented} rented (4mo, no active listings available)")
 print(f"Date range for subtitle: {datetime.now().strftime('%b %Y')}")
 
+# ─── Columnar layout ────────────────────────────────────────────────────
+# Active listings first, then rented. Every step below filters and groups
+# these arrays. File-local type/neighborhood ids are remapped onto shared
+# vocabularies (first appearance).
+def recode(codes, local_vocab, vocab):
+    """Map file-local codes onto vocab, adding unseen values to it."""
+    remap = np.array([vocab.setdefault(v, len(vocab)) for v in local_vocab], dtype=codes.dtype)
+    return remap[codes]
+
+type_vocab = {}
+nhood_to_id = {}
+type_id = np.concatenate([recode(p["type_id"], p["type_vocab"], type_vocab) for p in parts])
+nhood_id = np.concatenate([recode(p["nhood_id"], p["nhood_vocab"], nhood_to_id) for p in parts])
+nhood_names = list(nhood_to_id)
+beds, rent, lat, lng = (np.concatenate([p[c] for p in parts]) for c in ("beds", "rent", "lat", "lng"))
+del parts
+
 # ─── Step 1: Filter to 1BR only ─────────────────────────────────────────
-one_br = [l for l in all_raw if l.get("beds") == 1]
-print(f"1BR listings: {len(one_br)}")
+one_br = beds == 1
+print(f"1BR listings: {np.count_nonzero(one_br)}")
 
 # ─── Step 2: Remove bad data ────────────────────────────────────────────
 BAD_TYPES = {"THREEFAMILY", "TWOFAMILY", "MIXED_USE", "TOWNHOUSE", "LAND",
              "FOURFAMILY", "MULTIFAMILY", "COMMERCIAL"}
 
-removed_high_rent = 0
-removed_bad_type = 0
-removed_no_coords = 0
-cleaned = []
-
-for l in one_br:
-    rent = l.get("rent", 0)
-    ptype = (l.get("type") or "").upper()
-    lat = l.get("lat")
-    lng = l.get("lng")
-
-    if not lat or not lng:
-        removed_no_coords += 1
-        continue
-    if rent > 25000:
-        removed_high_rent += 1
-        continue
-    if ptype in BAD_TYPES:
-        removed_bad_type += 1
-        continue
-    if rent < 500:
-        continue
-    cleaned.append(l)
+# Rules apply in priority order (coords, then rent cap, then property type);
+# a listing is counted under the first rule it fails.
+BAD_TYPE_IDS = [code for ptype, code in type_vocab.items() if ptype in BAD_TYPES]
+bad_type = np.isin(type_id, BAD_TYPE_IDS)
+has_coords = np.isfinite(lat) & np.isfinite(lng) & (lat != 0) & (lng != 0)
+
+removed_no_coords = np.count_nonzero(one_br & ~has_coords)
+removed_high_rent = np.count_nonzero(one_br & has_coords & (rent > 25000))
+removed_bad_type = np.count_nonzero(one_br & has_coords & (rent <= 25000) & bad_type)
+valid = one_br & has_coords & (rent <= 25000) & ~bad_type & (rent >= 500)
+
+rent = rent[valid]
+lat = lat[valid]
+lng = lng[valid]
+nhood_id = nhood_id[valid]
 
 print(f"\nRemoved for bad data:")
 print(f"  Rent > $25,000: {removed_high_rent}")
 print(f"  Bad property type: {removed_bad_type}")
 print(f"  No coordinates: {removed_no_coords}")
-print(f"  Remaining after cleaning: {len(cleaned)}")
+print(f"  Remaining after cleaning: {len(rent)}")
 
 # ─── Step 3: Region assignment (9 custom regions) ────────────────────────
 REGION_MAP = {
@@ -204,156 +304,246 @@ REGION_MAP = {
     "The Rockaways": "Queens", "Whitestone": "Queens", "Woodhaven": "Queens",
 }
 
-def get_region(listing):
-    n = listing.get("neighborhood", "")
-    if n in REGION_MAP:
-        return REGION_MAP[n]
-    lat = listing["lat"]
-    lng = listing["lng"]
+# Regions as int codes into REGIONS (alphabetical), -1 if unknown
+REGIONS = sorted(set(REGION_MAP.values()))
+REGION_IDX = {r: i for i, r in enumerate(REGIONS)}
+REGION_ID = {n: REGION_IDX[r] for n, r in REGION_MAP.items()}
+
+def get_region_by_coord(lat, lng):
+    """Region code from coordinates, for listings with an unmapped neighborhood.
+
+    The rules are evaluated as boolean masks and resolved in priority order
+    by np.select; the first matching rule wins.
+    """
     # Staten Island
-    if lat < 40.65 and lng < -74.04:
-        return "Staten Island"
-    # Bronx
-    if lat > 40.85 or (lat > 40.80 and lng > -73.94):
-        if lat < 40.818:
-            return "South Bronx"
-        return "Bronx"
-    # Manhattan
-    if -74.03 < lng < -73.90 and 40.70 < lat < 40.88:
-        if lng > -73.96 or lat < 40.75:
-            # East side: 96th St boundary (~40.785)
-            # West side: 110th St boundary (~40.800)
-            if lng > -73.96 and lat >= 40.785:
-                return "Upper Manhattan"
-            if lng <= -73.96 and lat >= 40.800:
-                return "Upper Manhattan"
-            return "Lower Manhattan"
+    si = (lat < 40.65) & (lng < -74.04)
+    # Bronx (South Bronx below 149th St)
+    bronx = (lat > 40.85) | ((lat > 40.80) & (lng > -73.94))
+    south_bronx = bronx & (lat < 40.818)
+    # Manhattan. East side: 96th St boundary (~40.785),
+    # West side: 110th St boundary (~40.800)
+    manhattan = ((-74.03 < lng) & (lng < -73.90) & (40.70 < lat) & (lat < 40.88)
+                 & ((lng > -73.96) | (lat < 40.75)))
+    upper = ((lng > -73.96) & (lat >= 40.785)) | ((lng <= -73.96) & (lat >= 40.800))
     # Brooklyn
-    if lat < 40.74 and lng < -73.83:
-        if lat > 40.660:
-            return "North Brooklyn"
-        return "South Brooklyn"
+    brooklyn = (lat < 40.74) & (lng < -73.83)
     # Queens
-    if lng > -73.95 and lng < -73.90 and lat > 40.73:
-        return "W. Queens"
-    return "Queens"
-
-for l in cleaned:
-    l["borough"] = get_region(l)
-
-unknowns = [l for l in cleaned if l["borough"] == "Unknown"]
-if unknowns:
-    unknown_hoods = Counter(l.get("neighborhood", "?") for l in unknowns)
-    print(f"\nUnknown region listings: {len(unknowns)}")
-    for h, c in unknown_hoods.most_common(20):
-        sample = next(l for l in unknowns if l.get("neighborhood") == h)
-        print(f"  {h}: {c} (lat={sample['lat']}, lng={sample['lng']})")
+    w_queens = (lng > -73.95) & (lng < -73.90) & (lat > 40.73)
+
+    return np.select(
+        [si, south_bronx, bronx, manhattan & upper, manhattan,
+         brooklyn & (lat > 40.660), brooklyn, w_queens],
+        [REGION_IDX[r] for r in ("Staten Island", "South Bronx", "Bronx",
+                                 "Upper Manhattan", "Lower Manhattan",
+                                 "North Brooklyn", "South Brooklyn", "W. Queens")],
+        default=REGION_IDX["Queens"]).astype(np.int8)
+
+# Mapped neighborhoods resolve once per distinct name; the coordinate
+# rules only decide listings whose neighborhood isn't in REGION_MAP.
+nhood_region = np.array([REGION_ID.get(n, -1) for n in nhood_names], dtype=np.int8)
+region_from_nhood = nhood_region[nhood_id]
+region = np.where(region_from_nhood >= 0, region_from_nhood, get_region_by_coord(lat, lng))
+
+unknown = region < 0
+if unknown.any():
+    unknown_hoods = Counter(nhood_id[unknown].tolist())
+    print(f"\nUnknown region listings: {np.count_nonzero(unknown)}")
+    for code, c in unknown_hoods.most_common(20):
+        sample = np.flatnonzero(unknown & (nhood_id == code))[0]
+        print(f"  {nhood_names[code]}: {c} (lat={lat[sample]}, lng={lng[sample]})")
 
 # ─── Step 4: RS Filter ──────────────────────────────────────────────────
+# Cells are grouped by sorting integer cell keys and walking the runs of
+# equal keys; no per-cell lists are built.
+def key_runs(sorted_key):
+    """Start offset and length of each run of equal keys in a sorted array."""
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(sorted_key)) + 1))
+    return starts, np.diff(np.append(starts, len(sorted_key)))
+
 SPATIAL_GRID = 0.01
-spatial_cells = defaultdict(list)
-for l in cleaned:
-    key = (round(l["lat"] / SPATIAL_GRID) * SPATIAL_GRID,
-           round(l["lng"] / SPATIAL_GRID) * SPATIAL_GRID)
-    spatial_cells[key].append(l["rent"])
-
-spatial_medians = {}
-for key, rents in spatial_cells.items():
-    if len(rents) >= 3:
-        spatial_medians[key] = median(rents)
-
-def get_spatial_median(lat, lng):
-    key = (round(lat / SPATIAL_GRID) * SPATIAL_GRID,
-           round(lng / SPATIAL_GRID) * SPATIAL_GRID)
-    return spatial_medians.get(key)
-
-rs_flagged = 0
-non_rs = []
-for l in cleaned:
-    rent = l["rent"]
-    lat = l["lat"]
-    lng = l["lng"]
-    is_rs = False
-
-    # Single RS rule: Below 60% of local spatial median
-    sm = get_spatial_median(lat, lng)
-    if sm and rent < sm * 0.60:
-        is_rs = True
-
-    if is_rs:
-        rs_flagged += 1
-    else:
-        non_rs.append(l)
+# One lexsort orders rows by RS cell and by rent within each cell, so the
+# median (statistics.median semantics, mean of the middle pair for even
+# counts) is two indexed reads per run.
+clat = np.round(lat / SPATIAL_GRID).astype(np.int64)
+clng = np.round(lng / SPATIAL_GRID).astype(np.int64)
+key = clat * 100000 + clng
+order = np.lexsort((rent, key))
+sorted_rents = rent[order]
+starts, counts = key_runs(key[order])
+spatial_medians = (sorted_rents[starts + (counts - 1) // 2] + sorted_rents[starts + counts // 2]) / 2
+
+# Single RS rule: Below 60% of local spatial median (cells with <3
+# listings have no median and never flag anything)
+sm = np.empty(len(rent))
+sm[order] = np.repeat(np.where(counts >= 3, spatial_medians, 0), counts)
+is_rs = rent < sm * 0.60
+rs_flagged = np.count_nonzero(is_rs)
+
+non_rs = ~is_rs
+rent = rent[non_rs]
+lat = lat[non_rs]
+lng = lng[non_rs]
+region = region[non_rs]
+nhood_id = nhood_id[non_rs]
 
 print(f"\nRS filter: flagged {rs_flagged} listings (below 60% of spatial median)")
-print(f"After RS filter: {len(non_rs)} listings")
+print(f"After RS filter: {len(rent)} listings")
 
 # ─── Step 5: Borough medians ────────────────────────────────────────────
-borough_listings = defaultdict(list)
-for l in non_rs:
-    borough_listings[l["borough"]].append(l)
-
 print(f"\nRegion means:")
+region_sums = np.bincount(region, weights=rent, minlength=len(REGIONS))
+region_counts = np.bincount(region, minlength=len(REGIONS))
 borough_means = {}
-for borough, lsts in sorted(borough_listings.items()):
-    rents = [l["rent"] for l in lsts]
-    avg = int(round(sum(rents) / len(rents)))
+for code in np.flatnonzero(region_counts).tolist():
+    borough = REGIONS[code]
+    avg = int(round(region_sums[code] / region_counts[code]))
     borough_means[borough] = avg
-    print(f"  {borough}: ${avg:,.0f} (n={len(rents)})")
+    print(f"  {borough}: ${avg:,.0f} (n={region_counts[code]})")
 
 # ─── Step 6: Dense adaptive grid heat points ────────────────────────────
-def get_grid_size(lat, lng):
-    if lat < 40.786 and lng > -74.02 and lng < -73.93:
-        return 0.002
-    if 40.68 < lat < 40.73 and -73.99 < lng < -73.93:
-        return 0.002
-    return 0.003
+# Grid size per row as an int code into GS_TABLE: 0 = fine 0.002 grid
+# (Manhattan below 40.786 and the Williamsburg/Greenpoint box), 1 = 0.003.
+GS_TABLE = np.array([0.002, 0.003])
+
+def get_grid_code(lat, lng):
+    fine = (((lat < 40.786) & (lng > -74.02) & (lng < -73.93))
+            | ((lat > 40.68) & (lat < 40.73) & (lng > -73.99) & (lng < -73.93)))
+    return (~fine).astype(np.int8)
 
 # FIX: Require >= 2 listings per cell to eliminate ghost points
 MIN_CELL_COUNT = 2
 
-grid_cells = defaultdict(list)
-for l in non_rs:
-    lat = l["lat"]
-    lng = l["lng"]
-    gs = get_grid_size(lat, lng)
-    cell_lat = round(lat / gs) * gs
-    cell_lng = round(lng / gs) * gs
-    key = (round(cell_lat, 6), round(cell_lng, 6), gs)
-    grid_cells[key].append(l)
-
-heat_points = []
-dropped_thin = 0
-nhood_weighted_cells = 0
-for (clat, clng, gs), lsts in grid_cells.items():
-    if len(lsts) < MIN_CELL_COUNT:
-        dropped_thin += 1
-        continue
-    # ─── KEY CHANGE: Neighborhood-weighted mean ─────────────────────
-    # Group listings by neighborhood, compute mean per neighborhood,
-    # then average across neighborhoods (each neighborhood = equal weight).
-    by_nhood = defaultdict(list)
-    for l in lsts:
-        nhood = l.get("neighborhood", "Unknown")
-        by_nhood[nhood].append(l["rent"])
-    if len(by_nhood) > 1:
-        # Multiple neighborhoods share this cell — weight equally
-        nhood_means = []
-        for nhood, rents in by_nhood.items():
-            nhood_means.append(sum(rents) / len(rents))
-        cell_rent = sum(nhood_means) / len(nhood_means)
-        nhood_weighted_cells += 1
-    else:
-        # Single neighborhood — straight mean (no change from baseline)
-        rents = [l["rent"] for l in lsts]
-        cell_rent = sum(rents) / len(rents)
-    heat_points.append({
-        "lat": round(clat, 4),
-        "lng": round(clng, 4),
-        "rent": int(round(cell_rent)),
-        "count": len(lsts),
-    })
-print(f"Neighborhood-weighted cells: {nhood_weighted_cells}/{len(heat_points)} cells had multiple neighborhoods")
+# Cell keys pack the cell center in micro-degrees plus the grid size code
+# into one int64. The stable sort keeps each run in row order, so a run's
+# first row is the cell's first appearance.
+gs_code = get_grid_code(lat, lng)
+gs = GS_TABLE[gs_code]
+key_lat = np.round(np.round(lat / gs) * gs * 1e6).astype(np.int64)
+key_lng = np.round(np.round(lng / gs) * gs * 1e6).astype(np.int64)
+cell_key = (((key_lat << 28) + key_lng) << 1) | gs_code  # |key_lng| < 2**27
+
+order = np.argsort(cell_key, kind="stable")
+starts, counts = key_runs(cell_key[order])
+cell_of = np.empty(len(rent), np.int64)
+cell_of[order] = np.repeat(np.arange(len(counts)), counts)
+first = order[starts]
+
+# ─── KEY CHANGE: Neighborhood-weighted mean ─────────────────────────────
+# Group listings by neighborhood, compute mean per neighborhood,
+# then average across neighborhoods (each neighborhood = equal weight).
+# A cell with a single neighborhood gets its straight mean.
+# Both levels are bincount sums over int (cell, neighborhood) pair ids;
+# within a cell, pairs are summed in order of first appearance.
+pair_key = cell_of * len(nhood_names) + nhood_id
+pairs, pair_of = np.unique(pair_key, return_inverse=True)
+pair_means = np.bincount(pair_of, weights=rent) / np.bincount(pair_of)
+pair_first = np.full(len(pairs), len(rent))
+np.minimum.at(pair_first, pair_of, np.arange(len(rent)))
+pair_cell = pairs // len(nhood_names)
+by_first = np.lexsort((pair_first, pair_cell))
+nhood_counts = np.bincount(pair_cell, minlength=len(counts))
+cell_rent = np.bincount(pair_cell[by_first], weights=pair_means[by_first],
+                        minlength=len(counts)) / np.maximum(nhood_counts, 1)
+
+thick = counts >= MIN_CELL_COUNT
+dropped_thin = len(counts) - np.count_nonzero(thick)
+cells = np.flatnonzero(thick)
+cells = cells[np.argsort(first[cells])]
+nhood_weighted_cells = np.count_nonzero(nhood_counts[cells] > 1)
+
+# Heat points are kept as four parallel columns from here on
+hp_lat = np.round(key_lat[first[cells]] / 1e6, 4)
+hp_lng = np.round(key_lng[first[cells]] / 1e6, 4)
+hp_rent = np.rint(cell_rent[cells]).astype(np.int64)
+hp_count = counts[cells]
+print(f"Neighborhood-weighted cells: {nhood_weighted_cells}/{len(hp_rent)} cells had multiple neighborhoods")
+
+# ─── Heat point neighbor lists ──────────────────────────────────────────
+# Neighbors come from a uniform-grid spatial index instead of scanning every
+# pair. One query at the clamp radius (the larger of the two) gives the
+# neighbor lists for both passes; smoothing keeps the ones inside its own
+# radius.
+CLAMP_RADIUS = 0.015
+
+@njit(cache=True)
+def scan_row(i, lat, lng, radius, order, sorted_lat, lo, cnt, indices, dist, k):
+    """Find row i's neighbors; stores them at indices/dist[k:] when k >= 0.
+
+    Each bucket range is sorted by latitude, so the scan starts at the
+    first candidate within radius below lat[i] (binary search) and stops at
+    the first one beyond radius above it; dist >= |dlat| rules out the rest.
+    Returns the number of neighbors found.
+    """
+    # Tiny slack so float rounding in the window can never drop a neighbor;
+    # the exact dist < radius test below still decides.
+    window = radius * (1 + 1e-9)
+    m = 0
+    for b in range(lo.shape[0]):
+        start = lo[b, i]
+        end = start + cnt[b, i]
+        p = start + np.searchsorted(sorted_lat[start:end], lat[i] - window)
+        while p < end and sorted_lat[p] < lat[i] + window:
+            j = order[p]
+            dlat = lat[i] - lat[j]
+            dlng = lng[i] - lng[j]
+            d = math.sqrt(dlat * dlat + dlng * dlng)
+            if j != i and d < radius:
+                if k >= 0:
+                    indices[k + m] = j
+                    dist[k + m] = d
+                m += 1
+            p += 1
+    return m
+
+@njit(parallel=True, cache=True)
+def collect_neighbors(lat, lng, radius, order, lo, cnt):
+    """CSR rows (neighbor index and distance) from candidate bucket ranges.
+
+    Row i's candidates are order[lo[b, i]:lo[b, i] + cnt[b, i]] for each of
+    the 9 surrounding buckets b. Rows are counted, then filled, in parallel;
+    each row is sorted so neighbors come back in ascending index order.
+    """
+    n = len(lat)
+    sorted_lat = lat[order]
+    no_idx = np.empty(0, np.int64)
+    no_dist = np.empty(0, np.float64)
+    n_near = np.zeros(n, np.int64)
+    for i in prange(n):
+        n_near[i] = scan_row(i, lat, lng, radius, order, sorted_lat, lo, cnt, no_idx, no_dist, -1)
+    indptr = np.zeros(n + 1, np.int64)
+    indptr[1:] = np.cumsum(n_near)
+    indices = np.empty(indptr[n], np.int64)
+    dist = np.empty(indptr[n], np.float64)
+    for i in prange(n):
+        a, b = indptr[i], indptr[i + 1]
+        scan_row(i, lat, lng, radius, order, sorted_lat, lo, cnt, indices, dist, a)
+        perm = np.argsort(indices[a:b])
+        indices[a:b] = indices[a:b][perm]
+        dist[a:b] = dist[a:b][perm]
+    return indptr, indices, dist
+
+def radius_neighbors(lat, lng, radius):
+    """CSR neighbor lists: every other point closer than radius.
+
+    Points are bucketed on a grid with cell size = radius, so every neighbor
+    of a point sits in the 3x3 block of buckets around its own; buckets are
+    found by binary search on the bucket keys (sorted by bucket, then
+    latitude), and the distance checks run in the collect_neighbors kernel.
+    Returns indptr, indices and the matching distances.
+    """
+    blat = np.floor(lat / radius).astype(np.int64)
+    blng = np.floor(lng / radius).astype(np.int64)
+    bucket = (blat << 21) + blng  # |blng| < 2**20 for any NYC radius
+    order = np.lexsort((lat, bucket))
+    sorted_bucket = bucket[order]
+
+    keys = np.stack([bucket + (dlat_b << 21) + dlng_b
+                     for dlat_b in (-1, 0, 1) for dlng_b in (-1, 0, 1)])
+    lo = np.searchsorted(sorted_bucket, keys, "left")
+    cnt = np.searchsorted(sorted_bucket, keys, "right") - lo
+    return collect_neighbors(lat, lng, radius, order, lo, cnt)
+
+indptr, indices, dist = radius_neighbors(hp_lat, hp_lng, CLAMP_RADIUS)
 
 # ─── Gentle anisotropic smoothing ──────────────────────────────────────
 # w = (1/dist) * exp(-rent_diff² / sigma²)
@@ -361,79 +551,90 @@ print(f"Neighborhood-weighted cells: {nhood_weighted_cells}/{len(heat_points)} c
 SMOOTH_RADIUS = 0.008
 RENT_SIGMA = 1500
 RENT_SIGMA_SQ = RENT_SIGMA ** 2
-
-smoothed_points = []
-for i, hp in enumerate(heat_points):
-    total_weight = 2.0
-    weighted_rent = hp["rent"] * 2.0
-    for j, other in enumerate(heat_points):
-        if i == j:
-            continue
-        dlat = hp["lat"] - other["lat"]
-        dlng = hp["lng"] - other["lng"]
-        dist = math.sqrt(dlat**2 + dlng**2)
-        if dist < SMOOTH_RADIUS and dist > 0:
-            dist_w = 1.0 / dist
-            rent_diff = hp["rent"] - other["rent"]
-            rent_penalty = math.exp(-(rent_diff ** 2) / RENT_SIGMA_SQ)
-            w = dist_w * rent_penalty
-            total_weight += w
-            weighted_rent += other["rent"] * w
-    smoothed_rent = int(round(weighted_rent / total_weight))
-    smoothed_points.append({
-        "lat": hp["lat"],
-        "lng": hp["lng"],
-        "rent": smoothed_rent,
-        "count": hp["count"],
-    })
-heat_points = smoothed_points
+RENT_EXP_SCALE = -1.0 / RENT_SIGMA_SQ  # exp(rent_diff² * scale), sign folded in
+
+@njit(parallel=True, fastmath=True, cache=True)
+def smooth_aniso(indptr, indices, dist, rent, radius, exp_scale):
+    """Anisotropically smoothed rent of every heat point (rows run in parallel).
+
+    Pair distances come precomputed with the neighbor lists. Coincident
+    points (dist == 0) get no weight.
+    """
+    n = len(rent)
+    smoothed = np.empty(n, np.int64)
+    for i in prange(n):
+        total_weight = 2.0
+        weighted_rent = rent[i] * 2.0
+        for k in range(indptr[i], indptr[i + 1]):
+            j = indices[k]
+            if dist[k] < radius and dist[k] > 0:
+                rent_diff = rent[i] - rent[j]
+                w = math.exp(rent_diff * rent_diff * exp_scale) / dist[k]
+                total_weight += w
+                weighted_rent += rent[j] * w
+        smoothed[i] = np.rint(weighted_rent / total_weight)
+    return smoothed
+
+hp_rent = smooth_aniso(indptr, indices, dist, hp_rent, SMOOTH_RADIUS, RENT_EXP_SCALE)
 print(f"Anisotropic smoothing (radius={SMOOTH_RADIUS}, sigma=${RENT_SIGMA:,})")
 
 # ─── Neighbor median clamping ────────────────────────────────────────────
 # FIX: Relaxed from >= 2 neighbors to >= 1 to catch isolated outliers
-CLAMP_RADIUS = 0.015
 CLAMP_THRESHOLD = 1.50
 CLAMP_MAX_N = 10
-clamped_count = 0
-for i, hp in enumerate(heat_points):
-    if hp["count"] >= CLAMP_MAX_N:
-        continue
-    neighbors = []
-    for j, other in enumerate(heat_points):
-        if i == j:
+
+@njit(cache=True)
+def clamp_to_neighbor_median(indptr, indices, rent, count, max_n, threshold):
+    """Clamp rents far above the upper median of their neighbors, in place.
+
+    Points are visited in order and each median is taken from the current
+    rents, so a point clamped earlier counts at its clamped value. That makes
+    the loop serial. Returns each point's pre-clamp rent and the median it
+    was clamped to (-1 for points left alone).
+    """
+    n = len(rent)
+    old = np.full(n, -1, np.int64)
+    med = np.full(n, -1, np.int64)
+    for i in range(n):
+        m = indptr[i + 1] - indptr[i]
+        if count[i] >= max_n or m == 0:
             continue
-        dlat = hp["lat"] - other["lat"]
-        dlng = hp["lng"] - other["lng"]
-        dist = math.sqrt(dlat**2 + dlng**2)
-        if dist < CLAMP_RADIUS:
-            neighbors.append(other["rent"])
-    if len(neighbors) >= 1:
-        neighbor_med = sorted(neighbors)[len(neighbors) // 2]
-        if hp["rent"] > neighbor_med * CLAMP_THRESHOLD:
-            old_rent = hp["rent"]
-            hp["rent"] = neighbor_med
-            clamped_count += 1
-            if old_rent > neighbor_med * 2:
-                print(f"  CLAMPED: ({hp['lat']},{hp['lng']}) ${old_rent:,} → ${neighbor_med:,} (n={hp['count']}, {len(neighbors)} neighbors)")
+        buf = np.empty(m, np.int64)
+        for k in range(m):
+            buf[k] = rent[indices[indptr[i] + k]]
+        mid = np.partition(buf, m // 2)[m // 2]
+        if rent[i] > mid * threshold:
+            old[i] = rent[i]
+            med[i] = mid
+            rent[i] = mid
+    return old, med
+
+old_rent, neighbor_med = clamp_to_neighbor_median(indptr, indices, hp_rent, hp_count,
+                                                  CLAMP_MAX_N, CLAMP_THRESHOLD)
+clamped = neighbor_med >= 0
+n_neighbors = np.diff(indptr)
+for i in np.flatnonzero(clamped & (old_rent > neighbor_med * 2)).tolist():
+    print(f"  CLAMPED: ({hp_lat[i]},{hp_lng[i]}) ${old_rent[i]:,} → ${neighbor_med[i]:,} (n={hp_count[i]}, {n_neighbors[i]} neighbors)")
+clamped_count = np.count_nonzero(clamped)
 print(f"Neighbor median clamping: {clamped_count} points clamped (n<{CLAMP_MAX_N}, >{CLAMP_THRESHOLD:.0%} of neighbor median)")
 
-heat_points.sort(key=lambda x: (-x["rent"], x["lat"]))
-print(f"\nHeat points generated: {len(heat_points)} (dropped {dropped_thin} thin cells with <{MIN_CELL_COUNT} listings)")
+# Highest rent first, ties by latitude (lexsort is stable, like list.sort)
+order = np.lexsort((hp_lat, -hp_rent))
+hp_lat, hp_lng, hp_rent, hp_count = hp_lat[order], hp_lng[order], hp_rent[order], hp_count[order]
+print(f"\nHeat points generated: {len(hp_rent)} (dropped {dropped_thin} thin cells with <{MIN_CELL_COUNT} listings)")
 
 # ─── Write output ────────────────────────────────────────────────────────
+rows = [f"  {{lat:{la},lng:{ln},rent:{r},n:{c}}},\n"
+        for la, ln, r, c in zip(hp_lat.tolist(), hp_lng.tolist(), hp_rent.tolist(), hp_count.tolist())]
 with open("/tmp/heat_points_s8_nhood_aniso.js", "w") as f:
-    f.write("const HEAT_POINTS = [\n")
-    for hp in heat_points:
-        f.write(f"  {{lat:{hp['lat']},lng:{hp['lng']},rent:{hp['rent']},n:{hp['count']}}},\n")
-    f.write("];\n")
+    f.write("const HEAT_POINTS = [\n" + "".join(rows) + "];\n")
 
 print(f"\nOutput: /tmp/heat_points_s8_nhood_aniso.js")
 
 # ─── Summary ─────────────────────────────────────────────────────────────
-all_rents = [l["rent"] for l in non_rs]
-nyc_mean = int(round(sum(all_rents) / len(all_rents)))
+nyc_mean = int(round(rent.sum() / len(rent)))
 print(f"\nNYC overall mean: ${nyc_mean:,}")
-print(f"Total listings used: {len(non_rs)}")
+print(f"Total listings used: {len(rent)}")
 
 # Noho / Nolita diagnostic
 print("\n--- Key micro-neighborhood check ---")
@@ -447,9 +648,9 @@ checks = {
     "West Village":  (40.728, 40.738, -74.006, -73.998),
 }
 for name, (lat_lo, lat_hi, lng_lo, lng_hi) in checks.items():
-    cells = [hp for hp in heat_points if lat_lo <= hp["lat"] <= lat_hi and lng_lo <= hp["lng"] <= lng_hi]
-    if cells:
-        rents = [c["rent"] for c in cells]
-        print(f"  {name:>14}: {len(cells)} cells, ${min(rents):,}-${max(rents):,}, avg ${sum(rents)//len(rents):,}")
+    in_box = (lat_lo <= hp_lat) & (hp_lat <= lat_hi) & (lng_lo <= hp_lng) & (hp_lng <= lng_hi)
+    if in_box.any():
+        rents = hp_rent[in_box].tolist()
+        print(f"  {name:>14}: {len(rents)} cells, ${min(rents):,}-${max(rents):,}, avg ${sum(rents)//len(rents):,}")
     else:
         print(f"  {name:>14}: no cells")
@@ -17,6 +17,8 @@
 #
 # Prerequisites:
 #   - Python 3 with playwright installed: pip3 install playwright && playwright install
+#   - NumPy for the generators: pip3 install numpy
+#     (optional: pip3 install numba orjson for the JIT kernels and faster JSON parsing)
 #   - Git configured with push access to the repo
 #
 # Usage: